@@ -1,7 +1,8 @@
-import json
 import sys
 import os
 
+import orjson
+
 
 KEEP_ALL_CELLS = os.getenv("KEEP_ALL_CELLS", "0") == "1"
 
@@ -10,7 +11,7 @@ def is_cell_valid(cell):
     source = cell.get("source", [])
     if len(source) == 0 or KEEP_ALL_CELLS:
         return True
-    return source[0].strip().lower().find("# ignore") != 0 and source[0].strip().lower().find("#ignore") != 0
+    return not source[0].lstrip()[:16].lower().startswith(("# ignore", "#ignore"))
 
 
 files = sys.argv[1:]
@@ -38,10 +39,9 @@ result = {
 }
 
 for file in files:
-    with open(file) as file:
-        notebook = json.load(file)
-    result["cells"] += notebook["cells"]
+    with open(file, "rb") as file:
+        notebook = orjson.loads(file.read())
+    result["cells"].extend(cell for cell in notebook["cells"] if is_cell_valid(cell))
     result["metadata"] |= notebook["metadata"]
 
-result["cells"] = list(filter(is_cell_valid, result["cells"]))
-print(json.dumps(result, indent=2), end="")
+sys.stdout.buffer.write(orjson.dumps(result, option=orjson.OPT_INDENT_2))
@@ -1,49 +1,77 @@
-import json
 import sys
 import textwrap
+from concurrent.futures import ThreadPoolExecutor
 from html import escape
 import base64
+import functools
+import hashlib
 import os
-import glob
+import shutil
+
+import orjson
 
 IMAGES_DIR = os.path.join(
     os.path.dirname(__file__),
     "assets",
     "img",
 )
+# generated images get their own directory, so it can be wiped as a whole
+GENERATED_DIR = os.path.join(IMAGES_DIR, "generated")
+
+# images are written in the background while the next cells are rendered
+IO_POOL = ThreadPoolExecutor(max_workers=4)
+pending_writes = []
+written_images = set()
+
+OUTPUT_TEMPLATE = """\n{output}\n"""
+
+CODE_TEMPLATE = textwrap.dedent("""\
+    <details><summary>code</summary>
+
+    ```python
+    {code}
+    ```
+
+    </details>""") + OUTPUT_TEMPLATE
 
 
 def is_cell_valid(cell):
     source = cell.get("source", [])
     if len(source) == 0:
         return True
-    return source[0].strip().lower().find("# ignore") != 0 and source[0].strip().lower().find("#ignore") != 0
+    return not source[0].lstrip()[:16].lower().startswith(("# ignore", "#ignore"))
 
 
 def should_render_code(cell):
     source = cell.get("source", [])
     if len(source) == 0:
         return True
-    return source[0].strip().lower().find("# hidecode") != 0 and source[0].strip().lower().find("#hidecode") != 0
+    return not source[0].lstrip()[:16].lower().startswith(("# hidecode", "#hidecode"))
 
 def merge_cells(cells):
-    if len(cells) == 0:
-        return []
-
-    cells = list(filter(lambda x: x['cell_type'] != 'code' or len(x['source']) > 0, cells))
-
-    result = [cells[0]]
-    for cell in cells[1:]:
+    # yields merged cells one by one, so rendering can start
+    # without building a second list of all the cells
+    last = None
+    for cell in cells:
+        if cell['cell_type'] == 'code' and len(cell['source']) == 0:
+            continue
+        # source is a list of lines in ipynb, but may also be a single string
+        if isinstance(cell['source'], str):
+            cell['source'] = [cell['source']]
         if (
-            result[-1]['cell_type'] == cell['cell_type'] == 'code' and
-            len(result[-1]['outputs']) == 0
+            last is not None and
+            last['cell_type'] == cell['cell_type'] == 'code' and
+            len(last['outputs']) == 0
         ):
-            result[-1]['source'] += '\n\n#\n\n'
-            result[-1]['source'] += cell['source']
-            result[-1]['outputs'] += cell['outputs']
+            last['source'].append('\n\n#\n\n')
+            last['source'].extend(cell['source'])
+            last['outputs'] += cell['outputs']
         else:
-            result.append(cell)
-    return result
+            if last is not None:
+                yield last
+            last = cell
+    if last is not None:
+        yield last
 
 
 def overflowing_div(content):
@@ -84,46 +112,59 @@ def render(cell):
     assert False, f"unknown type {cell['cell_type'] = }"
 
 
+def content_hash(content):
+    # unlike hash(), stays the same between runs
+    return hashlib.blake2b(content, digest_size=8).hexdigest()
+
+
+def write_file(path, content):
+    with open(path, "wb") as fh:
+        fh.write(content)
+
+
+def write_file_async(path, content):
+    pending_writes.append(IO_POOL.submit(write_file, path, content))
+
+
+def save_generated_once(path, content):
+    # differently encoded payloads can still decode to the same image,
+    # which is then written only once
+    if path in written_images:
+        return
+    written_images.add(path)
+    write_file_async(path, content)
+
+
+@functools.lru_cache(maxsize=None)
 def save_png_and_get_name(base64_image):
-    imname = "generated_" + str(hash(base64_image)) + ".png"
+    # b64decode takes the ascii str as is, no need to encode a copy first
+    image = base64.b64decode(base64_image)
+    imname = content_hash(image) + ".png"
     path = os.path.join(
-        IMAGES_DIR,
+        GENERATED_DIR,
         imname
     )
-    with open(path, "wb") as fh:
-        fh.write(base64.b64decode(base64_image.encode()))
+    save_generated_once(path, image)
     return imname
 
 
+@functools.lru_cache(maxsize=None)
 def save_svg_and_get_name(svg_code):
-    imname = "generated_" + str(hash(svg_code)) + ".svg"
+    svg_bytes = svg_code.encode()
+    imname = content_hash(svg_bytes) + ".svg"
     path = os.path.join(
-        IMAGES_DIR,
+        GENERATED_DIR,
         imname
     )
-    with open(path, "w") as fh:
-        fh.write(svg_code)
+    save_generated_once(path, svg_bytes)
     return imname
 
 
 def render_code(cell):
-    render_code = should_render_code(cell)
-    if render_code:
-        template = """\
-        <details><summary>code</summary>
-
-        ```python
-        {code}
-        ```
-
-        </details>"""
-        template = textwrap.dedent(template)
+    if should_render_code(cell):
+        template = CODE_TEMPLATE
     else:
-        template = ""
-
-    template += """\n{output}\n"""
-
-
+        template = OUTPUT_TEMPLATE
 
     output_text = ''
     if len(cell['outputs']) > 0:
@@ -166,13 +207,13 @@ def render_code(cell):
                     )
                 elif "image/svg+xml" in data:
                     output_text += wide_div(
-                        '\n<img src="{{ im_path }}/' +
+                        '\n<img src="{{ im_path }}/generated/' +
                         save_svg_and_get_name(''.join(data["image/svg+xml"])) +
                         f'" alt="{"".join(data.get("text/plain", []))}" />\n'
                     )
                 elif "image/png" in data:
                     output_text += wide_div(
-                        '\n<img class="wider-section" src="{{ im_path }}/' +
+                        '\n<img class="wider-section" src="{{ im_path }}/generated/' +
                         save_png_and_get_name(data["image/png"]) +
                         f'" alt="{"".join(data.get("text/plain", []))}" />\n'
                     )
@@ -197,10 +238,10 @@ def render_markdown(cell):
 
 notebook = sys.argv[1]
 
-with open(notebook) as file:
-    notebook = json.load(file)
+with open(notebook, "rb") as file:
+    notebook = orjson.loads(file.read())
 
-result_markdown = """\
+result_markdown = ["""\
 ---
 layout: page
 title: ""
@@ -211,16 +252,17 @@ mathjax: true
 
 {% assign im_path = site.baseurl | append: "/assets/img/" %}
 
-"""
+"""]
 
-for hgx in (
-    glob.glob(os.path.join(IMAGES_DIR, "generated*.png")) +
-    glob.glob(os.path.join(IMAGES_DIR, "generated*.svg"))
-):
-  os.remove(hgx)
+shutil.rmtree(GENERATED_DIR, ignore_errors=True)
+os.makedirs(GENERATED_DIR)
 
 for cell in merge_cells(notebook["cells"]):
-    result_markdown += render(cell)
+    result_markdown.append(render(cell))
 
+# make sure all the images are on disk, raises if any write failed
+for write in pending_writes:
+    write.result()
+IO_POOL.shutdown()
 
-print(result_markdown)
+print(''.join(result_markdown))
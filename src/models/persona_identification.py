@@ -1,5 +1,3 @@
-import re
-
 import yaml
 from langchain.schema import AIMessage
 from langchain_core.messages import SystemMessage
@@ -10,11 +8,11 @@ from langchain_google_vertexai import ChatVertexAI
 
 
 def persona_capitalize(persona):
-    return " ".join(map(lambda x: x.capitalize(), persona.split("_")))
+    return " ".join(map(str.capitalize, persona.split("_")))
 
 
 def persona_lowercase(text):
-    return re.sub(" ", "_", text).lower()
+    return text.replace(" ", "_").lower()
 
 
 class PersonaIdentification(RunnableSequence):
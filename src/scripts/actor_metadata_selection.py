@@ -2,12 +2,18 @@ import argparse
 import logging
 import os
 import re
-import time
-from typing import Optional
+import shelve
+import threading
+from typing import Callable, Optional
 
+import joblib
 import pandas as pd
 import wikipediaapi
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
+from urllib3.util import Retry
+
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
 
 
 class WikipediaMetadataSelectorForActor:
@@ -15,34 +21,62 @@ class WikipediaMetadataSelectorForActor:
     This class implements the parse through the wikipedia to extract description of character's and their actors.
     """
 
-    def __init__(self):
+    def __init__(self, cache_file: Optional[str] = None):
         self.wiki = wikipediaapi.Wikipedia(
             user_agent="MovieCharacterSelector", language="en"
         )
-        self.page_cache = {}
+        # the requests come from several threads, so throttled (429) and failed
+        # ones are retried with backoff, honouring Retry-After, with the same
+        # policy as in movie_metadata_selection.py. wikipediaapi (0.7.1) sends
+        # everything through its private requests session
+        session = getattr(self.wiki, "_session", None)
+        if session is None:
+            raise RuntimeError(
+                "wikipediaapi.Wikipedia has no _session, "
+                "cannot set up retries for throttled requests"
+            )
+        retries = Retry(
+            total=3,
+            backoff_factor=1,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=None,
+        )
+        session.mount("https://", HTTPAdapter(max_retries=retries))
+        # only the extracted texts are cached, on disk if cache_file is given,
+        # so that reruns do not download the same pages again
+        self.page_cache = shelve.open(cache_file) if cache_file else {}
+        self.cache_lock = threading.Lock()
+
+    def close(self):
+        if isinstance(self.page_cache, shelve.Shelf):
+            self.page_cache.close()
 
     def get_wiki_page(self, title: str) -> Optional[wikipediaapi.WikipediaPage]:
         """
-        Fetch Wikipedia page with error handling and caching
+        Fetch Wikipedia page, None if it does not exist
         """
-        if title in self.page_cache:
-            return self.page_cache[title]
-
         try:
             page = self.wiki.page(title)
-            if page.exists():
-                self.page_cache[title] = page
-                return page
-            return None
+            return page if page.exists() else None
         except Exception as e:
             logging.error(f"Error fetching Wikipedia page for {title}: {str(e)}")
-            return None
+            raise
 
-    def extract_character_description(self, movie_id: str, character_name: str) -> str:
+    def get_cached_text(self, key: str, fetch: Callable[[], str]) -> str:
         """
-        Extract character description from movie's Wikipedia page
+        Return the text cached under key, calling fetch on a cache miss.
+        Failed fetches raise and are not cached
         """
-        page = self.get_wiki_page(str(movie_id))
+        with self.cache_lock:
+            text = self.page_cache.get(key)
+        if text is None:
+            text = fetch()
+            with self.cache_lock:
+                self.page_cache[key] = text
+        return text
+
+    def fetch_plot(self, movie_id: str) -> str:
+        page = self.get_wiki_page(movie_id)
         if not page:
             return ""
 
@@ -50,22 +84,9 @@ class WikipediaMetadataSelectorForActor:
         plot_section = page.section_by_title("Plot")
         if not plot_section:
             return ""
+        return plot_section.text
 
-        # find sentences containing character name
-        sentences = re.split(r"(?<=[.!?])\s+", plot_section.text)
-        character_sentences = [
-            sent for sent in sentences if character_name.lower() in sent.lower()
-        ]
-
-        if character_sentences:
-            # return the first mention of the character with some context
-            return character_sentences[0].strip()
-        return ""
-
-    def extract_actor_description(self, actor_name: str) -> str:
-        """
-        Extract actor description from their Wikipedia page
-        """
+    def fetch_actor_description(self, actor_name: str) -> str:
         page = self.get_wiki_page(actor_name)
         if not page:
             return ""
@@ -80,69 +101,154 @@ class WikipediaMetadataSelectorForActor:
             return description[:200] + "..." if len(description) > 200 else description
         return ""
 
+    def extract_character_description(self, movie_id: str, character_name: str) -> str:
+        """
+        Extract character description from movie's Wikipedia page
+        """
+        movie_id = str(movie_id)
+        text = self.get_cached_text(
+            f"plot:{movie_id}", lambda: self.fetch_plot(movie_id)
+        )
+
+        # most characters are never mentioned in the plot,
+        # so look for the name in the whole text before splitting it
+        name = character_name.lower()
+        if name not in text.lower():
+            return ""
+
+        # return the first mention of the character with some context
+        for sent in SENTENCE_SPLIT.split(text):
+            if name in sent.lower():
+                return sent.strip()
+        return ""
+
+    def extract_actor_description(self, actor_name: str) -> str:
+        """
+        Extract actor description from their Wikipedia page
+        """
+        return self.get_cached_text(
+            f"intro:{actor_name}", lambda: self.fetch_actor_description(actor_name)
+        )
+
 
-def enrich_character_data(input_file: str, output_file: str, n_rows: int = None):
+def process_row(
+    selector: WikipediaMetadataSelectorForActor,
+    idx: int,
+    movie_id: str,
+    character_name: str,
+    actor_name: str,
+):
     """
-    Main function to process the CSV and add character and actor descriptions
+    Extract character and actor descriptions for a single row
+    """
+    # a failed lookup leaves only its own column empty
+    try:
+        char_desc = selector.extract_character_description(movie_id, character_name)
+    except Exception as e:
+        logging.error(f"Error processing row {idx}: {str(e)}")
+        char_desc = ""
+    try:
+        actor_desc = selector.extract_actor_description(actor_name)
+    except Exception as e:
+        logging.error(f"Error processing row {idx}: {str(e)}")
+        actor_desc = ""
+
+    logging.info(f"Processed row {idx}: {character_name}")
+    return char_desc, actor_desc
+
+
+def enrich_chunk(
+    df: pd.DataFrame,
+    selector: WikipediaMetadataSelectorForActor,
+    n_jobs: int,
+    progress: tqdm,
+    offset: int = 0,
+):
+    """
+    Add character and actor descriptions to a chunk of the CSV
+    """
+    # the work is network-bound, so threads share one selector and its cache
+    rows = zip(
+        df["wiki_movie_id"].to_numpy(),
+        df["character_name"].to_numpy(),
+        df["actor_name"].to_numpy(),
+    )
+    results = joblib.Parallel(return_as="generator", n_jobs=n_jobs, prefer="threads")(
+        joblib.delayed(process_row)(selector, offset + idx, *row)
+        for idx, row in enumerate(rows)
+    )
+
+    # results come back in input order, so the columns are assigned at once
+    char_descs, actor_descs = [], []
+    for char_desc, actor_desc in results:
+        char_descs.append(char_desc)
+        actor_descs.append(actor_desc)
+        progress.update()
+
+    # new columns for the character_processed.csv
+    df["character_description"] = char_descs
+    df["actor_description"] = actor_descs
+    return df
+
+
+def enrich_character_data(
+    input_file: str,
+    output_file: str,
+    n_rows: int = None,
+    n_jobs: int = 8,
+    cache_file: Optional[str] = None,
+    chunk_size: int = 1000,
+):
+    """
+    Main function to process the CSV and add character and actor descriptions.
+    The CSV is read, enriched and written chunk by chunk
     """
     try:
         # read the CSV file
-        df = pd.read_csv(
+        chunks = pd.read_csv(
             input_file,
             header=None,
-            low_memory=False,
+            names=[
+                "wiki_movie_id",
+                "freebase_movie_id",
+                "character_name",
+                "actor_gender",
+                "actor_height",
+                "actor_ethnicity_id",
+                "actor_name",
+                "freebase_map_id",
+                "freebase_character_id",
+                "freebase_actor_id",
+                "actor_dob",
+                "movie_release_date",
+                "ethn_name",
+                "race",
+            ],
             dtype={
-                0: str,  # wiki_movie_id as string
-                4: str,  # actor_height as string
+                "wiki_movie_id": str,
+                "actor_height": str,
             },
             nrows=n_rows,
+            chunksize=chunk_size,
         )
 
-        print(f"Processing {len(df)} rows...")
-
-        df.columns = [
-            "wiki_movie_id",
-            "freebase_movie_id",
-            "character_name",
-            "actor_gender",
-            "actor_height",
-            "actor_ethnicity_id",
-            "actor_name",
-            "freebase_map_id",
-            "freebase_character_id",
-            "freebase_actor_id",
-            "actor_dob",
-            "movie_release_date",
-            "ethn_name",
-            "race",
-        ]
-
-        selector = WikipediaMetadataSelectorForActor()
-
-        # new columns for the character_processed.csv
-        df["character_description"] = ""
-        df["actor_description"] = ""
-
-        for idx, row in tqdm(df.iterrows(), total=len(df)):
-            time.sleep(1)
-
-            try:
-                char_desc = selector.extract_character_description(
-                    row["wiki_movie_id"], row["character_name"]
-                )
-                actor_desc = selector.extract_actor_description(row["actor_name"])
-
-                df.at[idx, "character_description"] = char_desc
-                df.at[idx, "actor_description"] = actor_desc
-
-                logging.info(f"Processed row {idx}: {row['character_name']}")
-
-            except Exception as e:
-                logging.error(f"Error processing row {idx}: {str(e)}")
-                continue
-
-        df.to_csv(output_file, index=False)
-        logging.info(f"Successfully saved enriched data to {output_file}")
+        selector = WikipediaMetadataSelectorForActor(cache_file)
+        n_processed = 0
+        try:
+            with tqdm(total=n_rows) as progress:
+                for df in chunks:
+                    df = enrich_chunk(df, selector, n_jobs, progress, n_processed)
+                    df.to_csv(
+                        output_file,
+                        mode="w" if n_processed == 0 else "a",
+                        header=n_processed == 0,
+                        index=False,
+                    )
+                    n_processed += len(df)
+        finally:
+            selector.close()
+
+        logging.info(f"Successfully saved {n_processed} enriched rows to {output_file}")
 
     except Exception as e:
         logging.error(f"Fatal error: {str(e)}")
@@ -172,6 +278,18 @@ def main():
         default=100,
         help="number of rows to process (default: 100, use -1 for all rows)",
     )
+    parser.add_argument(
+        "--n_jobs",
+        type=int,
+        default=8,
+        help="number of concurrent Wikipedia requests",
+    )
+    parser.add_argument(
+        "--cache_file",
+        type=str,
+        default=None,
+        help="where to cache fetched texts between runs (default: in output_dir)",
+    )
 
     args = parser.parse_args()
 
@@ -185,6 +303,7 @@ def main():
 
     input_file = os.path.join(args.data_dir, "character_processed.csv")
     output_file = os.path.join(args.output_dir, "character_processed_enriched.csv")
+    cache_file = args.cache_file or os.path.join(args.output_dir, "character_wiki_cache")
 
     print("Starting character data enrichment...")
     print(f"Input file: {input_file}")
@@ -192,7 +311,7 @@ def main():
     print(f"Processing {args.n_rows if args.n_rows != -1 else 'all'} rows")
 
     n_rows = None if args.n_rows == -1 else args.n_rows
-    enrich_character_data(input_file, output_file, n_rows)
+    enrich_character_data(input_file, output_file, n_rows, args.n_jobs, cache_file)
     print("Enrichment complete! Check character_enrichment.log for details.")
 
 
@@ -47,30 +47,42 @@ args = parser.parse_args()
 # ----------------- Functions -----------------
 
 
-def process_date(date_str, change_date=None):
+def process_dates(dates, change_date=None):
     """
-    Function processes date string and returns datetime object
+    Function processes a series of date strings and returns them as
+    YYYY-MM-DD strings, NaN when the date is missing or invalid
     """
     if change_date is None:
         change_date = {}
-    if date_str in change_date:
-        date_str = change_date[date_str]
-    if pd.isna(date_str):
-        return None
-    result = None
-    if len(date_str) == 4:  # it's just year
-        result = pd.to_datetime(date_str, format="%Y")
-    elif len(date_str) == 7:  # it's year and month
-        result = pd.to_datetime(date_str, format="%Y-%m")
-    elif len(date_str) == 10:  # it's year and month and day
-        result = pd.to_datetime(date_str, format="%Y-%m-%d")
-    elif len(date_str) == 22 or len(date_str) == 25:
-        # it also contains timezone info
-        result = pd.to_datetime(date_str).tz_localize(None)
-    else:
+    dates = dates.mask(dates.isin(list(change_date)), dates.map(change_date))
+
+    lengths = dates.str.len()
+    # timestamps also contain timezone info, only the date part is kept
+    dates = dates.mask(lengths.isin([22, 25]), dates.str[:10])
+    # just year, or year and month: complete to the first day
+    dates = dates.mask(lengths == 4, dates + "-01-01")
+    dates = dates.mask(lengths == 7, dates + "-01")
+
+    unknown = dates.notna() & ~lengths.isin([4, 7, 10, 22, 25])
+    for date_str in dates[unknown].unique():
         print(f"Unknown date format: {date_str}")
-        return None
-    return result.strftime("%Y-%m-%d")
+
+    result = pd.to_datetime(dates.mask(unknown), format="%Y-%m-%d", errors="coerce")
+    return result.dt.strftime("%Y-%m-%d")
+
+
+def apply_unique(values, func):
+    """
+    Function applies func once per distinct value of the series,
+    since raw columns repeat the same few values across many movies
+    """
+    codes, uniques = pd.factorize(values)
+    results = [func(value) for value in uniques]
+    missing = func(np.nan)
+    return pd.Series(
+        [results[code] if code >= 0 else missing for code in codes],
+        index=values.index,
+    )
 
 
 # ----------------------------------------------------------------
@@ -82,8 +94,8 @@ def process_languages(languages_raw, skip_languages=None):
     if pd.isna(languages_raw):
         return []
 
-    # get the languages
-    languages_raw = eval(languages_raw)
+    # get the languages, the Freebase dicts are stored as JSON
+    languages_raw = json.loads(languages_raw)
     languages_result = set()
 
     # process them
@@ -91,12 +103,8 @@ def process_languages(languages_raw, skip_languages=None):
         if lang in skip_languages:
             continue
         lang = lang.lower()
-        if "languages" in lang:
-            lang = lang.replace("language", "").strip()
-        elif "language" in lang:
+        if "language" in lang:
             lang = lang.replace("language", "").strip()
-        elif "Language" in lang:
-            lang = lang.replace("Language", "").strip()
         languages_result.add(lang)
     return list(languages_result)
 
@@ -111,7 +119,7 @@ def process_countries(countries_raw, rename_countries=None):
         return []
     # get the countries
     countries_result = set()
-    countries = eval(countries_raw)
+    countries = json.loads(countries_raw)
     # process them
     for country in countries.values():
         countries_result.update(rename_countries.get(country, [country]))
@@ -139,7 +147,7 @@ def process_genres(genre_raw, rename_genres=None):
         return []
     # get the genres
     genres_result = set()
-    genres = eval(genre_raw)
+    genres = json.loads(genre_raw)
     # process them
     for genre in genres.values():
         genres_result.update(rename_genres.get(genre, [genre]))
@@ -172,36 +180,40 @@ if args.process_type in ["all", "movies"]:
         inplace=True,
     )
 
-    movie_raw["languages"] = movie_raw["Movie languages"].apply(
-        lambda x: process_languages(
-            x, skip_languages=set(movies_helper["skip_languages"])
-        )
+    skip_languages = set(movies_helper["skip_languages"])
+    movie_raw["languages"] = apply_unique(
+        movie_raw["Movie languages"],
+        lambda x: process_languages(x, skip_languages=skip_languages),
     )
     print("[INFO] Movie: languages are processed")
 
     movie_raw["movie_release_date"] = pd.to_datetime(
-        movie_raw["Movie release date"].apply(
-            lambda x: process_date(x, change_date=movies_helper["change_date"])
+        process_dates(
+            movie_raw["Movie release date"], change_date=movies_helper["change_date"]
         )
     )
     print("[INFO] Movie: releases dates are processed")
 
-    movie_raw["countries_old"] = movie_raw["Movie countries"].apply(
+    movie_raw["countries_old"] = apply_unique(
+        movie_raw["Movie countries"],
         lambda x: process_countries(
             x, rename_countries=movies_helper["rename_countries"]
-        )
+        ),
     )
     print("[INFO] Movie: countries are processed")
 
-    movie_raw["countries"] = movie_raw["countries_old"].apply(
+    movie_raw["countries"] = apply_unique(
+        movie_raw["Movie countries"],
         lambda x: process_countries_old2new(
-            x, rename_countries=movies_helper["old_to_new"]
-        )
+            process_countries(x, rename_countries=movies_helper["rename_countries"]),
+            rename_countries=movies_helper["old_to_new"],
+        ),
     )
     print("[INFO] Movie: old2new countries are processed")
 
-    movie_raw["genres"] = movie_raw["Movie genres"].apply(
-        lambda x: process_genres(x, rename_genres=movies_helper["rename_genres"])
+    movie_raw["genres"] = apply_unique(
+        movie_raw["Movie genres"],
+        lambda x: process_genres(x, rename_genres=movies_helper["rename_genres"]),
     )
     print("[INFO] Movie: genres are processed")
 
@@ -242,14 +254,14 @@ if args.process_type in ["all", "characters"]:
         inplace=True,
     )
 
-    char_raw["actor_date_of_birth"] = char_raw["Actor date of birth"].apply(
-        lambda x: process_date(x, change_date=actors_helper["change_date"])
+    char_raw["actor_date_of_birth"] = process_dates(
+        char_raw["Actor date of birth"], change_date=actors_helper["change_date"]
     )
 
     print("[INFO] Characters: (Actor date of birth) are processed")
 
-    char_raw["movie_release_date"] = char_raw["Movie release date"].apply(
-        lambda x: process_date(x, change_date=movies_helper["change_date"])
+    char_raw["movie_release_date"] = process_dates(
+        char_raw["Movie release date"], change_date=movies_helper["change_date"]
     )
 
     print("[INFO] Characters: (Movie release date) are processed")
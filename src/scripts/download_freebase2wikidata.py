@@ -1,67 +1,120 @@
-# install wikidata before with the following command:
-# pip install Wikidata
-
 import argparse
+import gzip
 import json
 import os
 import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
+import requests
 from tqdm import tqdm
-from wikidata.client import Client
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--data_dir", type=str, default="../data/MovieSummaries")
 parser.add_argument("--output_dir", type=str, default="../data/")
 args = parser.parse_args()
 
-os.system("wget https://storage.googleapis.com/freebase-public/fb2w.nt.gz")
-os.system("gzip -dv fb2w.nt.gz")
+# download and decompress in one stream, straight to the output path
 out_path = os.path.join(args.output_dir, "fb2w.nt")
-os.system(f"mv fb2w.nt {out_path}")
-
-with open(out_path) as f:
-    lines = f.read().splitlines()
-
-pattern_subj = re.compile("rdf.freebase.com/ns/.*>")
-pattern_obj = re.compile("www.wikidata.org/entity/.*>")
-
-fb2w_raw = {}
-for line in tqdm(lines):
-    if not line or line[0] == "#":  # skip lines
-        continue
-    subject_raw, predicate_raw, obj_raw = line.split("\t")
-    subj = re.findall(pattern_subj, subject_raw)[0][19:-1].replace(".", "/", 1)
-    obj = re.findall(pattern_obj, obj_raw)[0][24:-1]
-    fb2w_raw[subj] = obj
+if not os.path.exists(out_path):
+    with requests.get(
+        "https://storage.googleapis.com/freebase-public/fb2w.nt.gz", stream=True
+    ) as response:
+        response.raise_for_status()
+        # written under a temporary name, so an interrupted download is not reused
+        with gzip.GzipFile(fileobj=response.raw) as gz, open(
+            out_path + ".part", "wb"
+        ) as out:
+            shutil.copyfileobj(gz, out, length=1 << 20)
+    os.replace(out_path + ".part", out_path)
 
 # prepare usefull data
-result_json = {}
 character = pd.read_csv(os.path.join(args.data_dir, "character_processed.csv"))
 all_etnicities = set(character["Actor ethnicity (Freebase ID)"].values)
 lost_char_names = set(
-    character[
+    character.loc[
         pd.isna(character["Character name"])
-        & ~pd.isna(character["Freebase character ID"])
-    ]
+        & ~pd.isna(character["Freebase character ID"]),
+        "Freebase character ID",
+    ].unique()
 )
 
 # no actors such as "Freebase actor ID" is not nan but "Actor date of birth" is nan
 # A lot of actors with known freebase actor id but unknown height... Do we want to parse it?
 all_required_fbid = all_etnicities | lost_char_names
 
-result_json = {fbid: fb2w_raw[fbid] for fbid in all_required_fbid if fbid in fb2w_raw}
+pattern_subj = re.compile("rdf.freebase.com/ns/.*>")
+pattern_obj = re.compile("www.wikidata.org/entity/.*>")
+
+# triples look like <http://rdf.freebase.com/ns/m.0695j>\t<...#sameAs>\t<http://www.wikidata.org/entity/Q6718> .
+# so the ids are cut at known offsets, the patterns are only a fallback
+prefix_subj = "<http://rdf.freebase.com/ns/"
+prefix_obj = "<http://www.wikidata.org/entity/"
+
+# only the required ids are kept, instead of mapping the whole dump first
+result_json = {}
+with open(out_path) as f:
+    # the file is large, so it is read line by line
+    for line in tqdm(f):
+        line = line.rstrip("\n")
+        if not line or line[0] == "#":  # skip lines
+            continue
+        subject_raw, predicate_raw, obj_raw = line.split("\t")
+        obj_raw = obj_raw.rstrip(" .")
+        if subject_raw.startswith(prefix_subj) and obj_raw.startswith(prefix_obj):
+            subj = "/" + subject_raw[len(prefix_subj) : -1]
+            obj = obj_raw[len(prefix_obj) : -1]
+        else:
+            subj = pattern_subj.search(subject_raw).group()[19:-1]
+            obj = pattern_obj.search(obj_raw).group()[24:-1]
+        subj = subj.replace(".", "/", 1)
+        if subj in all_required_fbid:
+            result_json[subj] = obj
+
 with open(os.path.join(args.output_dir, "useful_fb2w.json"), "w") as f:
     json.dump(result_json, f)
 
-# fill etnicities
-client = Client()
-etnid2name = {}
-for etn_id in tqdm(all_etnicities):
-    if etn_id in result_json:
-        entity = client.get(result_json[etn_id], load=True)
-        etnid2name[etn_id] = str(entity.label)
+# fill etnicities, wikidata returns the labels of up to 50 entities per request
+session = requests.Session()
+session.headers["User-Agent"] = "MovieCharacterSelector"
+
+
+def get_labels(entity_ids):
+    response = session.get(
+        "https://www.wikidata.org/w/api.php",
+        params={
+            "action": "wbgetentities",
+            "ids": "|".join(entity_ids),
+            "props": "labels",
+            "languages": "en",
+            "format": "json",
+        },
+        timeout=30,
+    )
+    response.raise_for_status()
+    return {
+        entity_id: entity["labels"]["en"]["value"]
+        for entity_id, entity in response.json()["entities"].items()
+        if "en" in entity.get("labels", {})
+    }
+
+
+etn_wikidata_ids = sorted(
+    {result_json[etn_id] for etn_id in all_etnicities if etn_id in result_json}
+)
+batches = [etn_wikidata_ids[i : i + 50] for i in range(0, len(etn_wikidata_ids), 50)]
+labels = {}
+with ThreadPoolExecutor(max_workers=4) as executor:
+    for batch_labels in tqdm(executor.map(get_labels, batches), total=len(batches)):
+        labels |= batch_labels
+
+etnid2name = {
+    etn_id: labels[result_json[etn_id]]
+    for etn_id in all_etnicities
+    if etn_id in result_json and result_json[etn_id] in labels
+}
 
 with open(os.path.join(args.output_dir, "etnid2name.json"), "w") as f:
     json.dump(etnid2name, f)
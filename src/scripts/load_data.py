@@ -7,9 +7,20 @@ import plotly.express as px
 import plotly.graph_objects as go
 
 
-archetype_data = pd.read_csv('../../data/enriched/persona_identification/archetype_predictions_joined.csv')
+# only the columns used below are parsed
+archetype_data = pd.read_csv(
+    '../../data/enriched/persona_identification/archetype_predictions_joined.csv',
+    usecols=['prediction', 'character_name', 'movie_name', 'movie_fb_id', 'actor_fb_id'],
+)
 
-character_data = pd.read_csv('../../data/MovieSummaries/character_processed.csv')
+character_data = pd.read_csv(
+    '../../data/MovieSummaries/character_processed.csv',
+    usecols=[
+        'Freebase movie ID', 'Character name', 'Actor gender', 'Actor height (in meters)',
+        'Actor name', 'Freebase actor ID', 'actor_date_of_birth', 'movie_release_date',
+        'ethn_name', 'race',
+    ],
+)
 
 character_data = character_data.rename(columns={
     'Wikipedia movie ID': "wikipedia_movie_id",
@@ -26,8 +37,8 @@ character_data = character_data.rename(columns={
 
 character_data = character_data.drop_duplicates(subset=["fb_movie_id", "fb_actor_id", "character_name"])
 
-actor_data = pd.read_csv('../../data/enriched/actors/actors_freebase.csv')
-actor_data = actor_data[["education", "professions_num", "date_of_birth", "nationality", "gender", "place_of_birth", "height", "weight", "religion", "id"]]
+actor_columns = ["education", "professions_num", "date_of_birth", "nationality", "gender", "place_of_birth", "height", "weight", "religion", "id"]
+actor_data = pd.read_csv('../../data/enriched/actors/actors_freebase.csv', usecols=actor_columns)[actor_columns]
 
 merged = pd.merge(
     archetype_data, 
@@ -38,8 +49,8 @@ merged = pd.merge(
 )
 merged = pd.merge(merged, actor_data, how="left", left_on="actor_fb_id", right_on="id").copy()
 
-merged.loc[merged.actor_height.isna() & ~merged.height.isna(), "actor_height"] = merged[merged.actor_height.isna() & ~merged.height.isna()].height
-merged.loc[merged.actor_gender.isna() & ~merged.gender.isna(), "actor_gender"] = merged[merged.actor_gender.isna() & ~merged.gender.isna()].gender
+merged["actor_height"] = merged.actor_height.fillna(merged.height)
+merged["actor_gender"] = merged.actor_gender.fillna(merged.gender)
 
 data = merged[[
     'prediction', 'character_name',
@@ -52,9 +63,12 @@ data = merged[[
 MIN_HEIGHT = 0.8
 MAX_HEIGHT = 2.7 # Max Palmen had height 249 cm
 data = data[((data.actor_height >= MIN_HEIGHT) & (data.actor_height <= MAX_HEIGHT)) | data.actor_height.isna()].copy()
-data["years_in_film"] = (pd.to_datetime(data.movie_release_date) - pd.to_datetime(data.actor_date_of_birth)).dt.days / 365.25
-data["actor_bmi"] = data.weight / (data.actor_height ** 2)
-data.loc[~data.education.isna(), "education"] = data.loc[~data.education.isna(), "education"].astype(int)
-data.loc[data.actor_gender == "Male", "actor_gender"] = "M"
-data.loc[data.actor_gender == "Female", "actor_gender"] = "F"
+# both dates are written by basic_process_cmu.py as %Y-%m-%d strings
+release_date = pd.to_datetime(data.movie_release_date, format="%Y-%m-%d").to_numpy()
+birth_date = pd.to_datetime(data.actor_date_of_birth, format="%Y-%m-%d").to_numpy()
+data["years_in_film"] = np.floor((release_date - birth_date) / np.timedelta64(1, "D")) / 365.25
+data["actor_bmi"] = data.weight.to_numpy() / (data.actor_height.to_numpy() ** 2)
+education_known = data.education.notna()
+data.loc[education_known, "education"] = data.loc[education_known, "education"].astype(int)
+data["actor_gender"] = data.actor_gender.replace({"Male": "M", "Female": "F"})
 data.rename(columns={"prediction": "archetype"}, inplace=True)
\ No newline at end of file
@@ -1,59 +1,232 @@
 import argparse
+import itertools
 import logging
 import os
 import json
-from typing import Optional, Dict
+import re
+import shelve
+import threading
+from typing import Optional, Dict, List, Set, Tuple
 
 import pandas as pd
-import wikipediaapi
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 from tqdm import tqdm
 import joblib
+import orjson
 import time
 
 
+API_URL = "https://en.wikipedia.org/w/api.php"
+TIMEOUT = 30
+# the MediaWiki API accepts at most 50 titles per query
+TITLES_PER_QUERY = 50
+# title variants tried for every movie, in order of preference
+TITLE_SUFFIXES = (" (film)", "(film)", "")
+MOVIES_PER_QUERY = TITLES_PER_QUERY // len(TITLE_SUFFIXES)
+# infobox labels and the fields they fill, in order of preference
+INFOBOX_FIELDS = (
+    ("Release dates", "release_date"),
+    ("Genre", "genres"),
+    ("Starring", "cast"),
+)
+INFOBOX_LABEL = re.compile("|".join(re.escape(label) for label, _ in INFOBOX_FIELDS))
+# section titles in order of preference
+CAST_SECTION_TITLES = ("Cast", "Reparto")
+PLOT_SECTION_TITLES = tuple(
+    title + space
+    for title in ("Plot", "Story", "Plot summary", "Synopsis")
+    for space in ("", " ")
+)
+# section headings of a plain-text extract, "== Title ==" for top-level sections
+SECTION_HEADING = re.compile(r"\n\n *(==+) (.*?) (==+) *\n")
+
+
+def split_sections(extract: str) -> Tuple[str, List[Tuple[str, str]]]:
+    """
+    Split a plain-text page extract into its summary and the (title, text)
+    of every section in page order. Subsections are listed separately and
+    are not part of their parent's text
+    """
+    headings = list(SECTION_HEADING.finditer(extract))
+    if not headings:
+        return extract.strip(), []
+    summary = extract[: headings[0].start()].strip()
+    sections = []
+    for heading, next_heading in zip(headings, headings[1:] + [None]):
+        end = next_heading.start() if next_heading else len(extract)
+        sections.append((heading.group(2), extract[heading.end() : end].strip()))
+    return summary, sections
+
+
+def page_text(summary: str, sections: List[Tuple[str, str]]) -> str:
+    """
+    Full page text, section titles on their own line without the == markers
+    """
+    text = summary + "\n\n" if summary else ""
+    for title, section_text in sections:
+        text += title + "\n" + section_text
+        if section_text:
+            text += "\n\n"
+    return text.strip()
+
+
+def find_section(sections: Dict[str, str], titles: Tuple[str, ...]) -> Optional[str]:
+    """
+    Return the text of the first of the titles present on the page
+    """
+    for title in titles:
+        if title in sections:
+            return sections[title]
+    return None
+
+
 class WikipediaMetadataSelectorForMovie:
     """
     This class implements the parse through the Wikipedia to extract the description of the movie's basic metadata
     """
 
-    def __init__(self):
-        self.wiki = wikipediaapi.Wikipedia(
-            user_agent="MovieMetadataSelector", language="en"
+    def __init__(self, cache_file: Optional[str] = None, n_connections: int = 16):
+        # one keep-alive connection per worker thread, the default pool keeps 10
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = "MovieMetadataSelector"
+        # the title lookups are POSTed but read-only, so every method is retried
+        retries = Retry(
+            total=3,
+            backoff_factor=1,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=None,
+        )
+        self.session.mount(
+            "https://", HTTPAdapter(pool_maxsize=n_connections, max_retries=retries)
         )
         self.page_cache = {}
+        # extracted metadata is also kept on disk if cache_file is given,
+        # so that reruns do not download the same pages again
+        self.metadata_cache = shelve.open(cache_file) if cache_file else {}
+        self.cache_lock = threading.Lock()
+
+    def close(self):
+        if isinstance(self.metadata_cache, shelve.Shelf):
+            self.metadata_cache.close()
+
+    def get_cached_metadata(self, title: str) -> Optional[Dict[str, Optional[str]]]:
+        with self.cache_lock:
+            return self.metadata_cache.get(title)
+
+    def get_metadata(self, title: str) -> Dict[str, Optional[str]]:
+        """
+        Cached extract_metadata_description. Movies without a page are not
+        cached, as they are retried on resume anyway
+        """
+        metadata = self.get_cached_metadata(title)
+        if metadata is None:
+            metadata = self.extract_metadata_description(title)
+            if metadata:
+                with self.cache_lock:
+                    self.metadata_cache[title] = metadata
+        return metadata
 
-    def get_wiki_page(self, title: str) -> Optional[wikipediaapi.WikipediaPage]:
+    def find_existing_titles(self, titles: List[str]) -> Set[str]:
         """
-        Fetch Wikipedia page with error handling and caching
+        Return the titles that exist on Wikipedia (directly or as a redirect),
+        asking the API about up to TITLES_PER_QUERY titles per request
         """
-        if title in self.page_cache:
-            return self.page_cache[title]
+        # "|" separates titles in a query and never appears in a page title
+        titles = [title for title in titles if "|" not in title]
+        existing = set()
+        for start in range(0, len(titles), TITLES_PER_QUERY):
+            batch = titles[start : start + TITLES_PER_QUERY]
+            response = self.session.post(
+                API_URL,
+                data={
+                    "action": "query",
+                    "format": "json",
+                    "redirects": 1,
+                    "titles": "|".join(batch),
+                },
+                timeout=TIMEOUT,
+            )
+            response.raise_for_status()
+            query = response.json()["query"]
+            normalized = {i["from"]: i["to"] for i in query.get("normalized", [])}
+            redirects = {i["from"]: i["to"] for i in query.get("redirects", [])}
+            found = {
+                page["title"]
+                for page in query["pages"].values()
+                if "missing" not in page and "invalid" not in page
+            }
+            for title in batch:
+                resolved = normalized.get(title, title)
+                if redirects.get(resolved, resolved) in found:
+                    existing.add(title)
+        return existing
 
+    def fetch_pages(self, titles: List[str]):
+        """
+        Resolve the Wikipedia page titles of several movies at once and cache
+        them, None is cached for movies without a page
+        """
+        titles = [title for title in titles if title not in self.page_cache]
+        if not titles:
+            return
         try:
-            page = self.wiki.page(title + " (film)")
-            if page.exists():
-                self.page_cache[title] = page
-                return page
-            page = self.wiki.page(title + "(film)")
-            if page.exists():
-                self.page_cache[title] = page
-                return page
-            page = self.wiki.page(title)
-            if page.exists():
-                self.page_cache[title] = page
-                return page
-            return None
+            existing = self.find_existing_titles(
+                [title + suffix for title in titles for suffix in TITLE_SUFFIXES]
+            )
         except Exception as e:
-            logging.error(f"Error fetching Wikipedia page for {title}: {str(e)}", exc_info=True)
-            return None
+            logging.error(f"Error fetching Wikipedia pages for {titles}: {str(e)}", exc_info=True)
+            return
+        for title in titles:
+            page = None
+            for suffix in TITLE_SUFFIXES:
+                if title + suffix in existing:
+                    page = title + suffix
+                    break
+            self.page_cache[title] = page
+
+    def get_wiki_page(self, title: str) -> Optional[str]:
+        """
+        Title of the movie's Wikipedia page with error handling and caching
+        """
+        if title not in self.page_cache:
+            self.fetch_pages([title])
+        return self.page_cache.get(title)
+
+    def fetch_extract(self, page: str) -> str:
+        """
+        Plain-text content of a page, with its sections marked by == headings
+        """
+        response = self.session.get(
+            API_URL,
+            params={
+                "action": "query",
+                "format": "json",
+                "formatversion": 2,
+                "prop": "extracts",
+                "explaintext": 1,
+                "exsectionformat": "wiki",
+                "redirects": 1,
+                "titles": page,
+            },
+            timeout=TIMEOUT,
+        )
+        response.raise_for_status()
+        return response.json()["query"]["pages"][0].get("extract", "")
 
     def extract_metadata_description(self, movie_id: str) -> Dict[str, Optional[str]]:
         """
         Extract movie's metadata description from its Wikipedia page
         """
         page = self.get_wiki_page(str(movie_id))
-        if not page or not page.exists():
+        if not page:
             return {}
+        # the whole page is downloaded with a single request
+        summary, section_list = split_sections(self.fetch_extract(page))
+        # like section_by_title, the last section with a given title wins
+        sections = dict(section_list)
+        text = page_text(summary, section_list)
 
         metadata = {
             "wikipedia_movie_id": movie_id,
@@ -64,55 +237,68 @@ class WikipediaMetadataSelectorForMovie:
             "cast": None,
         }
 
-        basic_info = page.section_by_title("Infobox")
+        basic_info = sections.get("Infobox")
         if basic_info:
-            for line in basic_info.text.splitlines():
-                if "Release dates" in line:
-                    metadata["release_date"] = line.split(":")[-1].strip()
-                elif "Genre" in line:
-                    metadata["genres"] = line.split(":")[-1].strip()
-                elif "Starring" in line:
-                    metadata["cast"] = line.split(":")[-1].strip()
-
-        cast_info = (
-            page.section_by_title("Cast")
-            or page.section_by_title("Reparto")
-        )
-        if cast_info and cast_info.text.strip():
-            metadata["cast"] = cast_info.text.strip()
-
-        plot_section = (
-            page.section_by_title("Plot")
-            or page.section_by_title("Plot ")
-            or page.section_by_title("Story")
-            or page.section_by_title("Story ")
-            or page.section_by_title("Plot summary")
-            or page.section_by_title("Plot summary ")
-            or page.section_by_title("Synopsis")
-            or page.section_by_title("Synopsis ")
-        )
-        if plot_section:
-            metadata["plot_summary"] = plot_section.text.strip()
+            # most lines have none of the labels and are skipped after one scan
+            for line in basic_info.splitlines():
+                if not INFOBOX_LABEL.search(line):
+                    continue
+                for label, field in INFOBOX_FIELDS:
+                    if label in line:
+                        metadata[field] = line.split(":")[-1].strip()
+                        break
+
+        cast_info = find_section(sections, CAST_SECTION_TITLES)
+        if cast_info:
+            metadata["cast"] = cast_info
+
+        plot_section = find_section(sections, PLOT_SECTION_TITLES)
+        if plot_section is not None:
+            metadata["plot_summary"] = plot_section
         else:
-            metadata["plot_summary"] = page.text.strip()
+            metadata["plot_summary"] = text
 
-        metadata["page_summary"] = page.summary.strip()
-        metadata["page"] = page.text.strip()
+        metadata["page_summary"] = summary
+        metadata["page"] = text
         return metadata
 
-def process(row: dict):
-    selector = WikipediaMetadataSelectorForMovie()
-    title = row['wiki_api_title']
-    if not isinstance(title, str):
-        title = row['Movie name']
+def dump_json(obj) -> bytes:
+    # missing CSV values (NaN) are written as null
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def load_json(data: bytes):
     try:
-        metadata = selector.extract_metadata_description(title)
-    except:
-        return row
-    return row | metadata
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        # files written by the stdlib json may contain NaN, which orjson rejects
+        return json.loads(data)
+
+
+def process(selector: WikipediaMetadataSelectorForMovie, titles: List[str]):
+    """
+    Return the metadata of each movie, empty if it could not be extracted
+    """
+    # the pages of the whole batch are looked up with a single API query
+    selector.fetch_pages(
+        [title for title in titles if selector.get_cached_metadata(title) is None]
+    )
+    result = []
+    for title in titles:
+        try:
+            result.append(selector.get_metadata(title))
+        except:
+            result.append({})
+    return result
 
 
-def enrich_movie_data(input_file: str, output_file: str, n_rows: int | None = None):
+def enrich_movie_data(
+    input_file: str,
+    output_file: str,
+    n_rows: int | None = None,
+    n_jobs: int = 16,
+    cache_file: str | None = None,
+):
     """
     Main function to process the CSV and add movie metadata descriptions
     """
@@ -129,30 +315,63 @@ def enrich_movie_data(input_file: str, output_file: str, n_rows: int | None = No
         print(f"Processing {len(df)} rows...")
         print(df.columns)
 
+        # finished rows are appended to the checkpoint one JSON object per line,
+        # the complete array is written to output_file only at the end
+        checkpoint_file = output_file + ".ndjson"
         result = []
         try:
-            with open(output_file) as file:
-                result = json.load(file)
-                already = [i["Wikipedia movie ID"] for i in result if 'page_summary' in i]
-                df = df[~df["Wikipedia movie ID"].isin(already)]
+            # the checkpoint of an interrupted run already holds every earlier row
+            with open(checkpoint_file, 'rb') as file:
+                valid_size = 0
+                for line in file:
+                    # the last line of an interrupted run may be incomplete
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        result.append(load_json(line))
+                    except ValueError:
+                        break
+                    valid_size += len(line)
+            # new rows are appended after the last complete one
+            os.truncate(checkpoint_file, valid_size)
         except FileNotFoundError:
-            pass
-
-        last_time = 0
-        for i, row in enumerate(
-                    joblib.Parallel(return_as='generator', n_jobs=16)(
-                    joblib.delayed(process)(row.to_dict())
-                    for _, row in tqdm(df.iterrows(), total=len(df))
-                )
-            ):
-            result.append(row)
-            if abs(time.time() - last_time) > 60:
-                with open(output_file, 'w') as file:
-                    json.dump(result, file, indent=2)
-                last_time = time.time()
-
-        with open(output_file, 'w') as file:
-            json.dump(result, file)
+            try:
+                with open(output_file, 'rb') as file:
+                    result = load_json(file.read())
+            except FileNotFoundError:
+                pass
+            # a new checkpoint starts with the rows of the previous complete run
+            with open(checkpoint_file, 'wb') as checkpoint:
+                for row in result:
+                    checkpoint.write(dump_json(row) + b"\n")
+        already = {i["Wikipedia movie ID"] for i in result if 'page_summary' in i}
+        df = df[~df["Wikipedia movie ID"].isin(already)]
+
+        # the work is network-bound, so threads share one selector and its cache
+        selector = WikipediaMetadataSelectorForMovie(cache_file, n_jobs)
+        last_time = time.time()
+        # workers only get the titles, the rows are merged back here in input order
+        titles = df["wiki_api_title"].fillna(df["Movie name"]).astype(str).tolist()
+        batches = joblib.Parallel(return_as='generator', n_jobs=n_jobs, prefer="threads")(
+            joblib.delayed(process)(selector, titles[start : start + MOVIES_PER_QUERY])
+            for start in range(0, len(titles), MOVIES_PER_QUERY)
+        )
+        rows = zip(df.to_dict("records"), itertools.chain.from_iterable(batches))
+        try:
+            with open(checkpoint_file, 'ab') as checkpoint:
+                for row, metadata in tqdm(rows, total=len(titles)):
+                    row = row | metadata
+                    result.append(row)
+                    checkpoint.write(dump_json(row) + b"\n")
+                    if abs(time.time() - last_time) > 60:
+                        checkpoint.flush()
+                        last_time = time.time()
+        finally:
+            selector.close()
+
+        with open(output_file, 'wb') as file:
+            file.write(dump_json(result))
+        os.remove(checkpoint_file)
         logging.info(f"Successfully saved enriched data to {output_file}")
 
     except Exception as e:
@@ -196,6 +415,18 @@ def main():
         default="movie_processed_enriched.json",
         help="name of the output file",
     )
+    parser.add_argument(
+        "--n_jobs",
+        type=int,
+        default=16,
+        help="number of concurrent Wikipedia requests",
+    )
+    parser.add_argument(
+        "--cache_file",
+        type=str,
+        default=None,
+        help="where to cache fetched metadata between runs (default: in output_dir)",
+    )
 
     args = parser.parse_args()
 
@@ -209,6 +440,7 @@ def main():
 
     input_file = os.path.join(args.data_dir, args.input_file_name)
     output_file = os.path.join(args.output_dir, args.output_file_name)
+    cache_file = args.cache_file or os.path.join(args.output_dir, "movie_wiki_cache")
 
     print("Starting movie data enrichment...")
     print(f"Input file: {input_file}")
@@ -216,7 +448,7 @@ def main():
     print(f"Processing {args.n_rows if args.n_rows != -1 else 'all'} rows")
 
     n_rows = None if args.n_rows == -1 else args.n_rows
-    enrich_movie_data(input_file, output_file, n_rows)
+    enrich_movie_data(input_file, output_file, n_rows, args.n_jobs, cache_file)
     print("Enrichment complete! Check movie_enrichment.log for details.")
 
 
@@ -1,7 +1,17 @@
+import joblib
 import wikipediaapi
 
 wiki = wikipediaapi.Wikipedia('en')
 
+# a section fills every field whose keyword is in its title
+SECTION_KEYWORDS = (
+    ('release', "release_date"),
+    ('plot', "plot_summary"),
+    ('genre', "genres"),
+    ('keywords', "keywords"),
+    ('cast', "cast"),
+)
+
 def get_movie_data(wikipedia_movie_id):
     page = wiki.page(wikipedia_movie_id)
 
@@ -18,19 +28,17 @@ def get_movie_data(wikipedia_movie_id):
     }
 
     for section in page.sections:
-        if 'release' in section.title.lower():
-            data["release_date"] = section.text
-
-        if 'plot' in section.title.lower():
-            data["plot_summary"] = section.text
-
-        if 'genre' in section.title.lower():
-            data["genres"] = section.text
+        title = section.title.lower()
+        for keyword, field in SECTION_KEYWORDS:
+            if keyword in title:
+                data[field] = section.text
 
-        if 'keywords' in section.title.lower():
-            data["keywords"] = section.text
+    return data
 
-        if 'cast' in section.title.lower():
-            data["cast"] = section.text
 
-    return data
\ No newline at end of file
+def get_movies_data(wikipedia_movie_ids, n_jobs=16):
+    # the requests are network-bound, so the pages are fetched in threads
+    return joblib.Parallel(n_jobs=n_jobs, prefer="threads")(
+        joblib.delayed(get_movie_data)(wikipedia_movie_id)
+        for wikipedia_movie_id in wikipedia_movie_ids
+    )